@@ -1,17 +1,44 @@
-from pydantic_settings import BaseSettings
-from typing import Optional
+import os
+from dataclasses import dataclass, fields
 
-class Settings(BaseSettings):
+
+def _read_env_file(path: str = ".env") -> dict:
+    """Lee pares CLAVE=valor de un archivo .env, si existe (claves en minúsculas)"""
+    values = {}
+    try:
+        with open(path, encoding="utf-8") as env_file:
+            for line in env_file:
+                line = line.strip()
+                if not line or line.startswith("#") or "=" not in line:
+                    continue
+                key, _, value = line.partition("=")
+                values[key.strip().lower()] = value.strip().strip('"').strip("'")
+    except FileNotFoundError:
+        pass
+    return values
+
+
+@dataclass(frozen=True, slots=True)
+class Settings:
     # Aplicación
     app_name: str = "notification-orchestrator"
     app_version: str = "1.0.0"
     port: int = 8088
 
+    # Rol del proceso: "all" (API + consumidores), "api" (solo HTTP).
+    # Los consumidores pueden correr aparte con `python -m app.consumer`.
+    role: str = "all"
+    # Workers de Uvicorn (variable WEB_CONCURRENCY)
+    web_concurrency: int = 1
+
     # RabbitMQ
     rabbitmq_host: str = "rabbitmq"
     rabbitmq_port: int = 5672
     rabbitmq_user: str = "guest"
     rabbitmq_password: str = "guest"
+    # Heartbeat AMQP (segundos): con 60 una conexión caída o bloqueada por
+    # el broker se detecta en ~1 minuto en lugar de ~10
+    rabbitmq_heartbeat: int = 60
 
     # Colas
     exchange_name: str = "app.events"
@@ -22,11 +49,74 @@ class Settings(BaseSettings):
     notifications_queue: str = "notifications.delivery"
     notifications_routing_key: str = "notifications.send"
 
+    # Particionado de usuarios.events (1 = sin particionar).
+    # Con N > 1 se declaran usuarios.events.0..N-1 tras un exchange
+    # x-consistent-hash y cada consumidor lee la partición SHARD_INDEX.
+    usuarios_shards: int = 1
+    shard_index: int = 0
+    usuarios_shard_exchange: str = "usuarios.events.hash"
+    usuarios_shard_hash_property: str = "message_id"
+
+    # Prefetch (QoS) del canal de consumo: mensajes sin confirmar que el broker
+    # entrega por consumidor. Muy bajo deja al consumidor esperando red entre
+    # mensajes; muy alto acapara mensajes (reparto injusto entre réplicas) y
+    # memoria local. Referencia: capacidad de proceso x tiempo medio por mensaje.
+    # No usar 1 (serializa el consumo) ni 0 (ilimitado; se sustituye por 100).
+    prefetch_count: int = 100
+
+    # Workers que procesan los mensajes fuera del thread de I/O de pika.
+    # Más de prefetch_count no aporta: nunca hay más mensajes en vuelo.
+    consumer_workers: int = 8
+
+    # Acks agrupados (basic_ack multiple=True): tamaño del lote (<= prefetch)
+    # y espera máxima antes de confirmar un lote incompleto
+    ack_batch_size: int = 32
+    ack_flush_interval: float = 0.1
+
+    # Publicación por lotes
+    publish_batch_size: int = 100
+    publish_flush_interval: float = 0.05
+
     # Logging
     log_level: str = "INFO"
 
-    class Config:
-        env_file = ".env"
-        case_sensitive = False
+    @property
+    def usuarios_consume_queue(self) -> str:
+        """Cola de usuarios que consume este proceso (su partición, si las hay)"""
+        if self.usuarios_shards > 1:
+            return f"{self.usuarios_queue}.{self.shard_index}"
+        return self.usuarios_queue
+
+    @classmethod
+    def _load(cls) -> "Settings":
+        """
+        Construye la configuración una sola vez al importar.
+        Cada campo se lee de la variable de entorno homónima (sin distinguir
+        mayúsculas) o, en su defecto, del archivo .env, y se convierte al
+        tipo declarado. Las variables de entorno tienen prioridad.
+
+        Raises:
+            ValueError: Si el particionado de usuarios es inconsistente
+        """
+        env_file = _read_env_file()
+        environ = {key.lower(): value for key, value in os.environ.items()}
+
+        values = {}
+        for field in fields(cls):
+            raw = environ.get(field.name, env_file.get(field.name))
+            if raw is not None:
+                values[field.name] = field.type(raw)
+        loaded = cls(**values)
+
+        # Falla al arrancar: una partición inexistente no se declara y el
+        # consumo acabaría con un 404 del broker
+        if loaded.usuarios_shards < 1:
+            raise ValueError(f"USUARIOS_SHARDS debe ser >= 1 (recibido {loaded.usuarios_shards})")
+        if not 0 <= loaded.shard_index < loaded.usuarios_shards:
+            raise ValueError(
+                f"SHARD_INDEX debe estar entre 0 y {loaded.usuarios_shards - 1} "
+                f"(recibido {loaded.shard_index})"
+            )
+        return loaded
 
-settings = Settings()
\ No newline at end of file
+settings = Settings._load()
@@ -0,0 +1,232 @@
+import logging
+import random
+import signal
+import threading
+
+import pika
+
+from app.services.rabbitmq_connection import create_connection, bootstrap_topology
+from app.services.rabbitmq_consumer import RabbitMQConsumer
+from app.services.notification_publisher import NotificationPublisher
+
+logger = logging.getLogger(__name__)
+
+# Variables globales para los servicios
+consumer_connection = None
+publisher_connection = None
+consumer = None
+publisher = None
+
+# Señal de parada; también interrumpe los reintentos de conexión
+_stop_event = threading.Event()
+
+# Espera base (con jitter) antes de abrir una nueva sesión tras perder la conexión
+RECONNECT_DELAY_SECONDS = 2
+
+def handle_usuario_creado(event):
+    """
+    Handler para eventos de usuario creado.
+    Transforma el evento y lo publica hacia el servicio de Delivery.
+    Devuelve el Future de la publicación: el mensaje de origen se confirma
+    cuando la notificación queda publicada. Los errores se propagan para que
+    el consumidor rechace el mensaje en lugar de confirmarlo.
+    """
+    logger.info("📩 Usuario creado recibido: %s", event.email)
+    try:
+        # Transformar evento de dominio a evento de notificación
+        notification = publisher.create_notification(event)
+
+        # Publicar hacia Delivery
+        published = publisher.publish_notification(notification)
+
+        logger.info("✅ Notificación de bienvenida procesada para: %s", event.email)
+        return published
+
+    except Exception as e:
+        logger.error("❌ Error procesando usuario creado: %s", e, exc_info=True)
+        raise
+
+def handle_sesion_iniciada(event):
+    """
+    Handler para eventos de sesión iniciada.
+    """
+    logger.info("📩 Sesión iniciada recibida: %s", event.email)
+    try:
+        notification = publisher.create_notification(event)
+        published = publisher.publish_notification(notification)
+
+        logger.info("✅ Notificación de login procesada para: %s", event.email)
+        return published
+
+    except Exception as e:
+        logger.error("❌ Error procesando sesión iniciada: %s", e, exc_info=True)
+        raise
+
+def handle_password_reset(event):
+    """
+    Handler para eventos de reset de password solicitado.
+    """
+    logger.info("📩 Password reset recibido: %s", event.email)
+    try:
+        notification = publisher.create_notification(event)
+        published = publisher.publish_notification(notification)
+
+        logger.info("✅ Notificación de reset de password procesada para: %s", event.email)
+        return published
+
+    except Exception as e:
+        logger.error("❌ Error procesando password reset: %s", e, exc_info=True)
+        raise
+
+def handle_password_updated(event):
+    """
+    Handler para eventos de password actualizado.
+    """
+    logger.info("📩 Password updated recibido: %s", event.email)
+    try:
+        notification = publisher.create_notification(event)
+        published = publisher.publish_notification(notification)
+
+        logger.info("✅ Notificación de password actualizado procesada para: %s", event.email)
+        return published
+
+    except Exception as e:
+        logger.error("❌ Error procesando password updated: %s", e, exc_info=True)
+        raise
+
+def start_rabbitmq_consumers():
+    """
+    Inicia los consumidores de RabbitMQ.
+    Se ejecuta en el thread de consumidores de la API o en el hilo principal
+    de `python -m app.consumer`. Ese thread es dueño de la conexión de
+    consumo; la de publicación la atiende el thread del publicador hasta
+    el cierre, que ocurre de nuevo en este thread.
+
+    Si la conexión se pierde durante el consumo (caída del broker, heartbeat
+    vencido), se reconecta tras una espera con jitter y se retoma el consumo.
+    Los errores de canal (topología incompatible, permisos, plugin ausente)
+    no se resuelven reconectando: detienen los consumidores. También termina
+    al pedir la parada, al agotar los reintentos de conexión o ante un error
+    que no sea de RabbitMQ.
+    """
+    while not _stop_event.is_set():
+        try:
+            _run_consumers()
+            return
+
+        except pika.exceptions.AMQPConnectionError as e:
+            if _stop_event.is_set():
+                return
+            # Espera entre sesiones: si la conexión cae justo tras abrirse,
+            # se evita reconectar en un bucle cerrado
+            wait = RECONNECT_DELAY_SECONDS * (0.5 + random.random())
+            logger.warning("⚠️ Conexión con RabbitMQ perdida (%s). Reconectando en %.1f segundos...", e, wait)
+            if _stop_event.wait(wait):
+                return
+        except pika.exceptions.AMQPError as e:
+            logger.critical("🔥 Error de RabbitMQ que no se resuelve reconectando: %r", e, exc_info=True)
+            return
+        except KeyboardInterrupt:
+            logger.info("⚠️ Consumo interrumpido por señal")
+            return
+        except Exception as e:
+            logger.error("❌ Error en consumidores: %s", e, exc_info=True)
+            return
+        finally:
+            _close_services()
+
+def _run_consumers():
+    """
+    Abre la conexión, prepara consumer y publisher y consume hasta que se
+    solicite la parada.
+
+    Raises:
+        pika.exceptions.AMQPConnectionError: Si se pierde la conexión con RabbitMQ
+        pika.exceptions.AMQPChannelError: Si el broker cierra un canal
+            (p. ej. topología incompatible o acceso denegado)
+    """
+    global consumer_connection, publisher_connection, consumer, publisher
+
+    logger.info("🔧 Configurando consumidores de RabbitMQ...")
+
+    # Conexiones separadas para consumir y publicar: el control de flujo del
+    # broker sobre la de publicación no puede bloquear el consumo
+    try:
+        consumer_connection = create_connection("consumer", stop_event=_stop_event)
+        if consumer_connection is None:
+            return
+        publisher_connection = create_connection("publisher", stop_event=_stop_event)
+        if publisher_connection is None:
+            return
+    except Exception as e:
+        # Reintentos agotados: no se vuelve a intentar desde el bucle exterior
+        raise RuntimeError(f"No se pudo conectar a RabbitMQ: {e}") from e
+
+    # En reconexiones la topología solo se verifica
+    bootstrap_topology(consumer_connection)
+
+    # La conexión de consumo la atiende este thread y la de publicación el
+    # thread del publicador; si esta se pierde, se detiene el consumo
+    consumer = RabbitMQConsumer(consumer_connection)
+    publisher = NotificationPublisher(publisher_connection, on_failure=consumer.stop)
+
+    # Registrar handlers para cada tipo de evento
+    consumer.consume_usuarios(handle_usuario_creado)
+    consumer.consume_sesiones(handle_sesion_iniciada)
+    consumer.consume_password_reset(handle_password_reset)
+    consumer.consume_password_updated(handle_password_updated)
+
+    logger.info("✅ Consumidores configurados. Iniciando consumo...")
+
+    # Iniciar consumo (bloqueante hasta que se llame a consumer.stop())
+    if not _stop_event.is_set():
+        consumer.start_consuming()
+
+    # El consumo se detuvo porque el publicador perdió su conexión: se
+    # propaga para reconectar la sesión
+    if publisher.error is not None:
+        raise publisher.error
+
+def _close_services():
+    """Cierra publisher, consumer y sus conexiones desde el thread que los usa"""
+    global consumer_connection, publisher_connection, consumer, publisher
+
+    # Primero se terminan los mensajes en curso (que aún publican), luego se
+    # publica lo pendiente y por último se confirman los acks, que esperan
+    # a que su notificación esté publicada
+    if consumer:
+        consumer.drain()
+    if publisher:
+        publisher.close()
+    if consumer:
+        consumer.close()
+    for connection in (publisher_connection, consumer_connection):
+        try:
+            if connection and not connection.is_closed:
+                connection.close()
+                logger.info("👋 Conexión a RabbitMQ cerrada")
+        except Exception as e:
+            logger.error("❌ Error cerrando conexión: %s", e)
+
+    consumer_connection = publisher_connection = consumer = publisher = None
+
+def stop_rabbitmq_consumers():
+    """
+    Solicita detener los consumidores. Puede llamarse desde cualquier thread.
+    """
+    _stop_event.set()
+    if consumer:
+        consumer.stop()
+
+
+# ========== PUNTO DE ENTRADA (solo consumidores, sin FastAPI) ==========
+if __name__ == "__main__":
+    from app.utils.logger import setup_logging
+
+    setup_logging()
+
+    # SIGTERM (docker stop) detiene el consumo y cierra las conexiones
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop_rabbitmq_consumers())
+
+    logger.info("🎬 Iniciando proceso de consumidores...")
+    start_rabbitmq_consumers()
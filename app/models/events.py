@@ -1,64 +1,66 @@
-from pydantic import BaseModel, Field
+import msgspec
 from datetime import datetime
-from typing import Optional, Dict, Any
-from enum import Enum
+from typing import Optional, Any, Final, Literal
 
-class NotificationType(str, Enum):
-    USER_WELCOME = "user_welcome"
-    LOGIN_NOTIFICATION = "login_notification"
-    PASSWORD_RESET = "password_reset"
-    PASSWORD_UPDATED = "password_updated"
+# Los eventos son msgspec.Struct: se decodifican directamente desde los bytes
+# del mensaje y se codifican a bytes sin dict intermedio.
+# rename="camel" mapea usuario_id <-> usuarioId, etc.
+# Los datetime aceptan RFC 3339 y epoch en segundos; el consumidor normaliza
+# además epoch en milisegundos, ISO sin segundos y solo fecha (ver _decoder
+# en rabbitmq_consumer).
 
-class UsuarioCreadoEvent(BaseModel):
-    usuario_id: str = Field(alias="usuarioId")
+# Tipos de notificación como constantes str: se codifican tal cual,
+# sin la conversión str -> Enum -> str en cada mensaje
+USER_WELCOME: Final = "user_welcome"
+LOGIN_NOTIFICATION: Final = "login_notification"
+PASSWORD_RESET: Final = "password_reset"
+PASSWORD_UPDATED: Final = "password_updated"
+
+NotificationType = Literal["user_welcome", "login_notification", "password_reset", "password_updated"]
+
+class UsuarioCreadoEvent(msgspec.Struct, rename="camel", frozen=True):
+    usuario_id: str
     email: str
     nombre: str
     timestamp: datetime
-    activation_token: Optional[str] = Field(None, alias="activationToken")
-    base_url: Optional[str] = Field(None, alias="baseUrl")
-
-    class Config:
-        populate_by_name = True
+    activation_token: Optional[str] = None
+    base_url: Optional[str] = None
 
-class SesionIniciadaEvent(BaseModel):
-    usuario_id: int = Field(alias="usuarioId")
+class SesionIniciadaEvent(msgspec.Struct, rename="camel", frozen=True):
+    usuario_id: int
     email: str
     nombre: str
     timestamp: datetime
-    ip_address: Optional[str] = Field(None, alias="ipAddress")
-    user_agent: Optional[str] = Field(None, alias="userAgent")
-    device_info: Optional[str] = Field(None, alias="deviceInfo")
+    ip_address: Optional[str] = None
+    user_agent: Optional[str] = None
+    device_info: Optional[str] = None
     location: Optional[str] = None
 
-    class Config:
-        populate_by_name = True
-
-class PasswordResetSolicitadoEvent(BaseModel):
-    usuario_id: str = Field(alias="usuarioId")
+class PasswordResetSolicitadoEvent(msgspec.Struct, rename="camel", frozen=True):
+    usuario_id: str
     email: str
     nombre: str
     token: str
-    fecha_solicitud: datetime = Field(alias="fechaSolicitud")
-
-    class Config:
-        populate_by_name = True
+    fecha_solicitud: datetime
 
-class PasswordActualizadoEvent(BaseModel):
-    usuario_id: str = Field(alias="usuarioId")
+class PasswordActualizadoEvent(msgspec.Struct, rename="camel", frozen=True):
+    usuario_id: str
     email: str
     nombre: str
-    fecha_actualizacion: datetime = Field(alias="fechaActualizacion")
+    fecha_actualizacion: datetime
 
-    class Config:
-        populate_by_name = True
+class LoginExtras(msgspec.Struct, rename="camel"):
+    """Datos adicionales de una notificación de login; se codifica sin dict intermedio"""
+    ip_address: str = "Desconocida"
+    user_agent: str = "Desconocido"
+    device_info: str = "Desconocido"
+    location: str = "Desconocida"
 
-class NotificationEvent(BaseModel):
+class NotificationEvent(msgspec.Struct, rename="camel", frozen=True):
     type: NotificationType
     email: str
-    user_name: str = Field(alias="userName")
+    user_name: str
     timestamp: datetime
-    additional_data: Optional[Dict[str, Any]] = Field(None, alias="additionalData")
-
-    class Config:
-        populate_by_name = True
-        use_enum_values = True
\ No newline at end of file
+    # Dict o LoginExtras. Se tipa como Any porque msgspec no admite uniones
+    # de dict y Struct; al decodificar se obtiene un dict.
+    additional_data: Any = None
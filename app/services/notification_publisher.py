@@ -1,222 +1,379 @@
 import pika
-import json
+import msgspec
 import logging
+import threading
 import time
+from collections import deque
+from concurrent.futures import Future
 from datetime import datetime
+from operator import attrgetter
+from typing import Callable, Optional
 from app.config.settings import settings
-from app.models.events import NotificationEvent, NotificationType
+from app.models.events import (
+    NotificationEvent,
+    LoginExtras,
+    USER_WELCOME,
+    LOGIN_NOTIFICATION,
+    PASSWORD_RESET,
+    PASSWORD_UPDATED,
+    UsuarioCreadoEvent,
+    SesionIniciadaEvent,
+    PasswordResetSolicitadoEvent,
+    PasswordActualizadoEvent
+)
 
 logger = logging.getLogger(__name__)
 
+# Encoder JSON reutilizado en todas las publicaciones
+_ENCODER = msgspec.json.Encoder()
+
+
+def _extract_welcome_extra(event: UsuarioCreadoEvent):
+    """Datos adicionales de bienvenida: token de activación y base URL, si existen"""
+    additional_data = {}
+
+    # Si hay token de activación, incluirlo
+    if event.activation_token:
+        additional_data['activationToken'] = event.activation_token
+
+    # Si hay base URL, incluirla
+    if event.base_url:
+        additional_data['baseUrl'] = event.base_url
+
+    return additional_data if additional_data else None
+
+
+def _extract_login_extra(event: SesionIniciadaEvent):
+    """Datos adicionales de login; los campos vacíos toman el valor por defecto de LoginExtras"""
+    extras = LoginExtras()
+    if event.ip_address:
+        extras.ip_address = event.ip_address
+    if event.user_agent:
+        extras.user_agent = event.user_agent
+    if event.device_info:
+        extras.device_info = event.device_info
+    if event.location:
+        extras.location = event.location
+    return extras
+
+
+def _extract_reset_extra(event: PasswordResetSolicitadoEvent):
+    """Datos adicionales de reset de password: el token de reseteo"""
+    return {'resetToken': event.token}
+
+
+# Tipo de evento -> (tipo de notificación, getter del timestamp, extractor de datos adicionales).
+# Sin getter de timestamp se usa la hora actual; sin extractor, additionalData es null.
+_BUILDERS = {
+    UsuarioCreadoEvent: (USER_WELCOME, None, _extract_welcome_extra),
+    SesionIniciadaEvent: (LOGIN_NOTIFICATION, attrgetter('timestamp'), _extract_login_extra),
+    PasswordResetSolicitadoEvent: (PASSWORD_RESET, attrgetter('fecha_solicitud'), _extract_reset_extra),
+    PasswordActualizadoEvent: (PASSWORD_UPDATED, attrgetter('fecha_actualizacion'), None),
+}
+
 class NotificationPublisher:
     """
     Publicador de eventos de notificación hacia el servicio de Delivery.
     Transforma eventos de dominio en eventos de notificación.
-    """
-
-    def __init__(self):
-        self.connection = None
-        self.channel = None
-        self.setup_connection()
 
-    def setup_connection(self):
-        """Establece conexión con RabbitMQ para publicar mensajes con reintentos"""
-        MAX_RETRIES = 20
-        WAIT_SECONDS = 3
+    La conexión de publicación la atiende un thread propio: si el broker la
+    bloquea (connection.blocked), solo espera ese thread y el bucle de I/O
+    del consumo sigue entregando mensajes y enviando heartbeats.
+    """
 
-        credentials = pika.PlainCredentials(
-            settings.rabbitmq_user,
-            settings.rabbitmq_password
-        )
-        parameters = pika.ConnectionParameters(
-            host=settings.rabbitmq_host,
-            port=settings.rabbitmq_port,
-            credentials=credentials,
-            heartbeat=600,
-            blocked_connection_timeout=300
+    def __init__(self, connection: pika.BlockingConnection, on_failure: Optional[Callable[[], None]] = None):
+        """
+        Args:
+            connection: Conexión de publicación (separada de la de consumo)
+            on_failure: Se invoca desde el thread del publicador si su
+                conexión o su canal se pierden; el error queda en `error`
+        """
+        self.connection = connection
+        self.channel = self.connection.channel()
+        self.error = None
+        self._on_failure = on_failure
+
+        # Modo transaccional: se publican N mensajes y se confirman con un
+        # único tx_commit (un solo round-trip al broker por lote). El canal
+        # bloqueante de pika espera el ack de cada mensaje con confirm_delivery,
+        # así que el lote se confirma vía transacción.
+        self.channel.tx_select()
+
+        # Lote en curso (mensajes serializados) y su Future, que se completa
+        # al confirmarse su tx_commit. Al llegar a publish_batch_size el lote
+        # se cierra y pasa a _ready: cada transacción publica un solo lote.
+        self._pending = deque()
+        self._batch = Future()
+        self._ready = deque()
+        self._lock = threading.Lock()
+        self._flush_timer = None
+
+        # Valores constantes de cada publicación, resueltos una sola vez.
+        # pika exige str para exchange y routing key, así que no se codifican.
+        self._exchange = settings.exchange_name
+        self._routing_key = settings.notifications_routing_key
+        self._base_props_kwargs = dict(
+            delivery_mode=2,  # Mensaje persistente
+            content_type='application/json'
         )
 
-        attempt = 1
-        while attempt <= MAX_RETRIES:
-            try:
-                logger.info(f"🔄 Intentando conectar publicador a RabbitMQ (intento {attempt}/{MAX_RETRIES})...")
-                self.connection = pika.BlockingConnection(parameters)
-                self.channel = self.connection.channel()
-
-                # Declarar exchange
-                self.channel.exchange_declare(
-                    exchange=settings.exchange_name,
-                    exchange_type='topic',
-                    durable=True
-                )
-
-                # Declarar cola de destino (notifications.delivery)
-                self.channel.queue_declare(
-                    queue=settings.notifications_queue,
-                    durable=True
-                )
-
-                # Vincular cola al exchange
-                self.channel.queue_bind(
-                    exchange=settings.exchange_name,
-                    queue=settings.notifications_queue,
-                    routing_key=settings.notifications_routing_key
-                )
-
-                logger.info("✅ Publicador de notificaciones configurado exitosamente")
-                return
-
-            except Exception as e:
-                logger.error(f"❌ Error configurando publicador (intento {attempt}/{MAX_RETRIES}): {e}")
-                if attempt == MAX_RETRIES:
-                    logger.critical("🔥 No se pudo conectar el publicador después de múltiples intentos. Abortando.")
-                    raise
+        # A partir de aquí la conexión solo se usa desde este thread
+        # (publicaciones, temporizadores y heartbeats) hasta close()
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="publisher-io", daemon=True)
+        self._thread.start()
 
-                wait = WAIT_SECONDS
-                logger.info(f"⏳ Reintentando en {wait} segundos...")
-                time.sleep(wait)
-                attempt += 1
+        logger.info("✅ Publicador de notificaciones configurado exitosamente")
 
-    def publish_notification(self, notification: NotificationEvent):
+    def publish_notification(self, notification: NotificationEvent) -> Future:
         """
-        Publica una notificación al servicio de Delivery.
+        Encola una notificación para el servicio de Delivery.
+        El buffer se publica al llegar a publish_batch_size mensajes o tras
+        publish_flush_interval segundos, lo que ocurra primero.
+        Se puede llamar desde cualquier thread: la publicación se agenda en el
+        thread del publicador, único que usa su conexión.
 
         Args:
             notification: Evento de notificación a publicar
 
+        Returns:
+            Future del lote que contiene la notificación: se completa cuando
+            el broker confirma el lote (tx_commit) o con la excepción si falla
+            (también si la conexión ya está cerrada). El mensaje de origen no
+            debe confirmarse antes.
+
         Raises:
-            RuntimeError: Si ocurre un error al publicar
+            RuntimeError: Si la notificación no se puede serializar
         """
         try:
-            # Serializar el evento a JSON usando el esquema de Pydantic
-            message = notification.model_dump(mode='json', by_alias=True)
-
-            logger.debug(f"🚀 Publicando NotificationEvent: {notification.type} -> {notification.email}")
-
-            # Publicar mensaje
-            self.channel.basic_publish(
-                exchange=settings.exchange_name,
-                routing_key=settings.notifications_routing_key,
-                body=json.dumps(message, default=str),
-                properties=pika.BasicProperties(
-                    delivery_mode=2,  # Mensaje persistente
-                    content_type='application/json',
-                    timestamp=int(datetime.now().timestamp())
-                )
-            )
-
-            logger.info(f"📤 Notificación publicada exitosamente: {notification.type} -> {notification.email}")
-
+            body = self._serialize(notification)
         except Exception as e:
-            logger.error(f"❌ Error publicando notificación: {e}")
+            logger.error("❌ Error serializando notificación: %s", e)
             raise RuntimeError(f"Error publicando notificación: {e}")
 
-    def create_user_welcome_notification(self, event) -> NotificationEvent:
-        """
-        Crea una notificación de bienvenida a partir de un evento de usuario creado.
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("🚀 Encolando NotificationEvent: %s -> %s", notification.type, notification.email)
 
-        Args:
-            event: UsuarioCreadoEvent
+        with self._lock:
+            self._pending.append(body)
+            pending = len(self._pending)
+            batch = self._batch
+            if pending >= settings.publish_batch_size:
+                self._seal_batch()
 
-        Returns:
-            NotificationEvent configurado para bienvenida
-        """
-        additional_data = {}
-
-        # Si hay token de activación, incluirlo
-        if hasattr(event, 'activation_token') and event.activation_token:
-            additional_data['activationToken'] = event.activation_token
-
-        # Si hay base URL, incluirla
-        if hasattr(event, 'base_url') and event.base_url:
-            additional_data['baseUrl'] = event.base_url
-
-        notification = NotificationEvent(
-            type=NotificationType.USER_WELCOME,
-            email=event.email,
-            user_name=event.nombre,
-            timestamp=datetime.now(),
-            additional_data=additional_data if additional_data else None
-        )
+        try:
+            if pending >= settings.publish_batch_size:
+                # Un solo flush agendado por lote completo
+                self.connection.add_callback_threadsafe(self._flush_quietly)
+            elif pending == 1:
+                # Primer mensaje del lote: programar el flush por tiempo
+                self.connection.add_callback_threadsafe(self._arm_flush_timer)
+        except Exception as e:
+            # Conexión cerrada: el lote en curso ya no se publicará
+            logger.error("❌ Error agendando la publicación: %s", e)
+            self._fail_pending(RuntimeError(f"Error publicando notificación: {e}"))
 
-        logger.debug(f"📝 Notificación de bienvenida creada para: {event.email}")
-        return notification
+        return batch
 
-    def create_login_notification(self, event) -> NotificationEvent:
+    def publish_batch(self, notifications):
         """
-        Crea una notificación de inicio de sesión.
+        Publica varias notificaciones y espera una sola confirmación del broker.
+        Debe llamarse desde el thread del publicador.
 
         Args:
-            event: SesionIniciadaEvent
+            notifications: Iterable de NotificationEvent
 
-        Returns:
-            NotificationEvent configurado para notificación de login
+        Raises:
+            RuntimeError: Si ocurre un error al publicar
         """
-        additional_data = {
-            'ipAddress': event.ip_address if event.ip_address else 'Desconocida',
-            'userAgent': event.user_agent if event.user_agent else 'Desconocido',
-            'deviceInfo': event.device_info if event.device_info else 'Desconocido',
-            'location': event.location if event.location else 'Desconocida'
-        }
-
-        notification = NotificationEvent(
-            type=NotificationType.LOGIN_NOTIFICATION,
-            email=event.email,
-            user_name=event.nombre,
-            timestamp=event.timestamp,
-            additional_data=additional_data
-        )
+        try:
+            bodies = [self._serialize(notification) for notification in notifications]
+            self._publish_and_commit(bodies)
+        except Exception as e:
+            logger.error("❌ Error publicando lote de notificaciones: %s", e)
+            raise RuntimeError(f"Error publicando notificaciones: {e}")
 
-        logger.debug(f"📝 Notificación de login creada para: {event.email}")
-        return notification
+    def flush(self):
+        """
+        Publica las notificaciones pendientes del buffer y confirma el lote.
+        Debe llamarse desde el thread del publicador.
 
-    def create_password_reset_notification(self, event) -> NotificationEvent:
+        Raises:
+            RuntimeError: Si ocurre un error al publicar
         """
-        Crea una notificación de reset de contraseña.
+        if self._flush_timer is not None:
+            self.connection.remove_timeout(self._flush_timer)
+            self._flush_timer = None
+
+        # El lock solo cubre el intercambio del buffer: los workers no
+        # esperan el round-trip de la publicación
+        with self._lock:
+            if self._pending:
+                self._seal_batch()
+            ready, self._ready = self._ready, deque()
+
+        while ready:
+            bodies, batch = ready.popleft()
+            try:
+                self._publish_and_commit(bodies)
+            except Exception as e:
+                logger.error("❌ Error publicando notificaciones: %s", e)
+                error = RuntimeError(f"Error publicando notificaciones: {e}")
+                batch.set_exception(error)
+                for _, remaining in ready:
+                    remaining.set_exception(error)
+                raise error from e
+
+            batch.set_result(len(bodies))
+
+    def _seal_batch(self):
+        """Cierra el lote en curso y abre uno nuevo (con el lock tomado)"""
+        self._ready.append((self._pending, self._batch))
+        self._pending, self._batch = deque(), Future()
+
+    def _arm_flush_timer(self):
+        """Programa el flush por tiempo del lote en curso, si aún no lo está"""
+        if self._flush_timer is None and self._pending:
+            self._flush_timer = self.connection.call_later(
+                settings.publish_flush_interval,
+                self._flush_on_timer
+            )
 
-        Args:
-            event: PasswordResetSolicitadoEvent
+    def _flush_on_timer(self):
+        """Flush por tiempo: el temporizador ya venció, así que no hay que cancelarlo"""
+        self._flush_timer = None
+        self._flush_quietly()
 
-        Returns:
-            NotificationEvent configurado para reset de password
+    def _flush_quietly(self):
         """
-        notification = NotificationEvent(
-            type=NotificationType.PASSWORD_RESET,
-            email=event.email,
-            user_name=event.nombre,
-            timestamp=event.fecha_solicitud,
-            additional_data={'resetToken': event.token}
+        Flush agendado en el thread del publicador; los errores se registran
+        sin propagarse. Si el broker cerró el canal (p. ej. exchange
+        inexistente), ningún lote posterior podrá publicarse: se trata como
+        una caída del publicador.
+        """
+        try:
+            self.flush()
+        except RuntimeError as e:
+            if self.channel.is_closed:
+                self._fail(e.__cause__ or e)
+
+    def _run(self):
+        """
+        Bucle de I/O de la conexión de publicación: ejecuta las publicaciones
+        agendadas, los temporizadores y los heartbeats.
+        Si la conexión o el canal se pierden, guarda el error y avisa con
+        on_failure para que la sesión se cierre o reconecte.
+        """
+        try:
+            while self._running:
+                self.connection.process_data_events(time_limit=1)
+        except Exception as e:
+            self._fail(e)
+
+    def _fail(self, error: Exception):
+        """Detiene el publicador, guarda el error y avisa con on_failure"""
+        self._running = False
+        self.error = error
+        logger.error("❌ Publicador detenido: %s", error)
+        if self._on_failure:
+            self._on_failure()
+
+    def _publish_and_commit(self, bodies):
+        """Publica los mensajes en el canal y los confirma con un único tx_commit"""
+        basic_publish = self.channel.basic_publish
+        exchange = self._exchange
+        routing_key = self._routing_key
+
+        # Una sola lectura del reloj y unas mismas propiedades para todo el lote
+        properties = pika.BasicProperties(
+            timestamp=int(time.time()),
+            **self._base_props_kwargs
         )
 
-        logger.debug(f"📝 Notificación de reset de password creada para: {event.email}")
-        return notification
+        for body in bodies:
+            basic_publish(
+                exchange=exchange,
+                routing_key=routing_key,
+                body=body,
+                properties=properties
+            )
+        self.channel.tx_commit()
 
-    def create_password_updated_notification(self, event) -> NotificationEvent:
+        logger.info("📤 %s notificaciones publicadas exitosamente", len(bodies))
+
+    @staticmethod
+    def _serialize(notification: NotificationEvent) -> bytes:
+        """Serializa la notificación a bytes JSON"""
+        return _ENCODER.encode(notification)
+
+    def create_notification(self, event, now: Optional[datetime] = None) -> NotificationEvent:
         """
-        Crea una notificación de contraseña actualizada.
+        Crea la notificación correspondiente a un evento de dominio.
+        El tipo, la fuente del timestamp y los datos adicionales salen de _BUILDERS.
 
         Args:
-            event: PasswordActualizadoEvent
+            event: UsuarioCreadoEvent, SesionIniciadaEvent,
+                PasswordResetSolicitadoEvent o PasswordActualizadoEvent
+            now: Hora ya capturada por el llamador, para eventos sin timestamp
+                propio (bienvenida). Si es None se lee el reloj una vez.
 
         Returns:
-            NotificationEvent configurado para password actualizado
+            NotificationEvent listo para publicar
+
+        Raises:
+            ValueError: Si el tipo de evento no tiene builder registrado
         """
+        try:
+            notification_type, get_timestamp, extract_extra = _BUILDERS[type(event)]
+        except KeyError:
+            raise ValueError(f"Tipo de evento no soportado: {type(event).__name__}")
+
         notification = NotificationEvent(
-            type=NotificationType.PASSWORD_UPDATED,
+            type=notification_type,
             email=event.email,
             user_name=event.nombre,
-            timestamp=event.fecha_actualizacion,
-            additional_data=None
+            timestamp=get_timestamp(event) if get_timestamp else (now or datetime.now()),
+            additional_data=extract_extra(event) if extract_extra else None
         )
 
-        logger.debug(f"📝 Notificación de password actualizado creada para: {event.email}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("📝 Notificación %s creada para: %s", notification_type, event.email)
         return notification
 
     def close(self):
-        """Cierra la conexión al publicador"""
+        """
+        Detiene el thread del publicador, publica lo pendiente y cierra el canal.
+        La conexión vuelve a ser del thread que llama.
+        """
+        self._running = False
+        try:
+            if self.connection.is_open:
+                # Despierta el bucle para que vea la parada sin esperar
+                self.connection.add_callback_threadsafe(lambda: None)
+        except Exception:
+            pass
+        self._thread.join()
+
         try:
-            if self.connection and not self.connection.is_closed:
-                self.connection.close()
+            if self.channel and self.channel.is_open:
+                self.flush()
+                self.channel.close()
                 logger.info("👋 Publicador cerrado")
         except Exception as e:
-            logger.error(f"❌ Error cerrando publicador: {e}")
\ No newline at end of file
+            logger.error("❌ Error cerrando publicador: %s", e)
+
+        # Lo que no llegó a publicarse se da por fallido: sus mensajes de
+        # origen no se confirman y el broker los reentregará
+        self._fail_pending(RuntimeError("Publicador cerrado sin publicar el lote"))
+
+    def _fail_pending(self, error: Exception):
+        """Descarta los lotes sin publicar y completa sus Future con el error"""
+        with self._lock:
+            if self._pending:
+                self._seal_batch()
+            ready, self._ready = self._ready, deque()
+        if ready:
+            logger.warning("⚠️ %s notificaciones sin publicar: %s",
+                           sum(len(bodies) for bodies, _ in ready), error)
+            for _, batch in ready:
+                batch.set_exception(error)
\ No newline at end of file
@@ -0,0 +1,225 @@
+import pika
+import logging
+import random
+import socket
+import threading
+import time
+
+from typing import Optional
+from app.config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+USUARIOS_ROUTING_KEY = "usuarios.created"
+
+# Colas de eventos de dominio y el routing key con el que se vinculan.
+# La cola de usuarios se declara aparte porque puede estar particionada.
+INBOUND_QUEUES = [
+    (settings.sesiones_queue, "sesiones.iniciada"),
+    (settings.password_reset_queue, "password.reset.requested"),
+    (settings.password_updated_queue, "password.updated"),
+]
+
+# Keepalive TCP: detecta conexiones muertas a nivel de socket (p. ej. tras un
+# failover del balanceador) aunque no haya tráfico AMQP. pika ya activa
+# TCP_NODELAY; el tamaño de los buffers se deja al autotuning del kernel
+# (net.core.rmem_max / wmem_max).
+TCP_OPTIONS = {
+    'TCP_KEEPIDLE': 60,
+    'TCP_KEEPINTVL': 10,
+    'TCP_KEEPCNT': 3,
+}
+
+# Se activa tras declarar la topología completa por primera vez en el proceso
+_topology_declared = False
+
+
+def create_connection(name: str, stop_event: Optional[threading.Event] = None) -> Optional[pika.BlockingConnection]:
+    """
+    Abre una conexión a RabbitMQ con reintentos.
+    El proceso usa una conexión para consumir y otra para publicar, de modo
+    que el control de flujo sobre los publicadores no frene el consumo.
+
+    Args:
+        name: Propósito de la conexión ("consumer", "publisher"); se envía
+            como connection_name y aparece en la consola de RabbitMQ
+        stop_event: Si se activa durante la espera entre reintentos, se
+            abandona la conexión (cierre de la aplicación)
+
+    Returns:
+        Conexión bloqueante de pika ya abierta, o None si se canceló
+
+    Raises:
+        pika.exceptions.AMQPConnectionError: Si no se pudo conectar tras
+            MAX_RETRIES intentos (socket.gaierror si el host nunca llegó a
+            resolverse). Cualquier otro error (configuración, bugs) se
+            propaga de inmediato, sin reintentar.
+    """
+    MAX_RETRIES = 20
+    BASE_WAIT_SECONDS = 0.5
+    MAX_WAIT_SECONDS = 30
+
+    credentials = pika.PlainCredentials(
+        settings.rabbitmq_user,
+        settings.rabbitmq_password
+    )
+
+    # pika resuelve el host en cada intento y prueba todas sus direcciones
+    # (varios registros A en un cluster). Los reintentos no se delegan en
+    # pika (connection_attempts/retry_delay): su espera es fija y no se puede
+    # interrumpir al cerrar la aplicación, así que los hace el bucle de abajo.
+    parameters = pika.ConnectionParameters(
+        host=settings.rabbitmq_host,
+        port=settings.rabbitmq_port,
+        credentials=credentials,
+        heartbeat=settings.rabbitmq_heartbeat,
+        blocked_connection_timeout=300,
+        connection_attempts=1,
+        socket_timeout=5,
+        stack_timeout=15,
+        tcp_options=TCP_OPTIONS,
+        client_properties={'connection_name': f"{settings.app_name}-{name}"}
+    )
+
+    attempt = 1
+    while attempt <= MAX_RETRIES:
+        try:
+            logger.info("🔄 Intentando conectar %s a RabbitMQ (intento %s/%s)...", name, attempt, MAX_RETRIES)
+            connection = pika.BlockingConnection(parameters)
+            logger.info("✅ Conexión %s a RabbitMQ establecida exitosamente", name)
+            return connection
+
+        except (pika.exceptions.AMQPConnectionError, socket.gaierror) as e:
+            logger.error("❌ Error conectando a RabbitMQ: %s", e)
+            if attempt == MAX_RETRIES:
+                logger.critical("🔥 No se pudo conectar después de múltiples intentos. Abortando.")
+                raise
+
+            # Backoff exponencial con jitter: evita que todas las réplicas
+            # reintenten a la vez mientras el broker se recupera
+            wait = min(MAX_WAIT_SECONDS, BASE_WAIT_SECONDS * 2 ** attempt) * (0.5 + random.random())
+            logger.info("⏳ Reintentando en %.1f segundos...", wait)
+            if stop_event is not None:
+                if stop_event.wait(wait):
+                    logger.info("⚠️ Conexión cancelada por cierre de la aplicación")
+                    return None
+            else:
+                time.sleep(wait)
+            attempt += 1
+
+
+def bootstrap_topology(connection: pika.BlockingConnection):
+    """
+    Asegura la topología (exchange, colas y bindings) en el broker.
+    La primera llamada del proceso la declara completa; las siguientes
+    (reconexiones) solo verifican de forma pasiva que las colas existan y
+    redeclaran si el broker las perdió.
+
+    Args:
+        connection: Conexión abierta a RabbitMQ
+    """
+    global _topology_declared
+
+    if _topology_declared:
+        try:
+            _verify_topology(connection)
+            return
+        except pika.exceptions.ChannelClosedByBroker as e:
+            logger.warning("⚠️ Topología incompleta en el broker (%s), redeclarando...", e)
+
+    _declare_topology(connection)
+    _topology_declared = True
+
+
+def _verify_topology(connection: pika.BlockingConnection):
+    """
+    Comprueba con declaraciones pasivas que las colas usadas existen.
+
+    Raises:
+        pika.exceptions.ChannelClosedByBroker: Si alguna cola no existe
+    """
+    queue_names = [settings.usuarios_consume_queue, settings.notifications_queue]
+    queue_names += [queue_name for queue_name, _ in INBOUND_QUEUES]
+
+    with connection.channel() as channel:
+        for queue_name in queue_names:
+            channel.queue_declare(queue=queue_name, passive=True)
+
+    logger.info("✅ Topología verificada en el broker")
+
+
+def _declare_topology(connection: pika.BlockingConnection):
+    """
+    Declara el exchange, las colas de entrada y la cola de notificaciones.
+    Cada declaración es un RPC síncrono (un round-trip): el canal bloqueante
+    de pika no admite nowait. Solo ocurre una vez por proceso; en las
+    reconexiones bootstrap_topology se limita a verificar.
+
+    Args:
+        connection: Conexión abierta a RabbitMQ
+    """
+    with connection.channel() as channel:
+        channel.exchange_declare(
+            exchange=settings.exchange_name,
+            exchange_type='topic',
+            durable=True
+        )
+
+        queues = INBOUND_QUEUES + [
+            (settings.notifications_queue, settings.notifications_routing_key)
+        ]
+        if settings.usuarios_shards > 1:
+            _declare_usuarios_shards(channel)
+        else:
+            queues = [(settings.usuarios_queue, USUARIOS_ROUTING_KEY)] + queues
+
+        for queue_name, routing_key in queues:
+            # Declarar cola como durable para persistencia
+            channel.queue_declare(queue=queue_name, durable=True)
+
+            # Vincular cola al exchange con routing key
+            channel.queue_bind(
+                exchange=settings.exchange_name,
+                queue=queue_name,
+                routing_key=routing_key
+            )
+
+            logger.info("✅ Cola configurada: %s -> %s", queue_name, routing_key)
+
+
+def _declare_usuarios_shards(channel):
+    """
+    Particiona los eventos de usuarios en N colas (usuarios.events.0..N-1)
+    mediante un exchange x-consistent-hash vinculado al exchange principal.
+    Requiere el plugin rabbitmq_consistent_hash_exchange y que el productor
+    informe la propiedad usada como clave de hash (por defecto message_id).
+
+    Args:
+        channel: Canal abierto sobre el que declarar la topología
+    """
+    channel.exchange_declare(
+        exchange=settings.usuarios_shard_exchange,
+        exchange_type='x-consistent-hash',
+        durable=True,
+        arguments={'hash-property': settings.usuarios_shard_hash_property}
+    )
+
+    # Los eventos de usuarios pasan del exchange topic al de hash
+    channel.exchange_bind(
+        destination=settings.usuarios_shard_exchange,
+        source=settings.exchange_name,
+        routing_key=USUARIOS_ROUTING_KEY
+    )
+
+    for shard in range(settings.usuarios_shards):
+        queue_name = f"{settings.usuarios_queue}.{shard}"
+        channel.queue_declare(queue=queue_name, durable=True)
+
+        # En x-consistent-hash el routing key del binding es el peso de la cola
+        channel.queue_bind(
+            exchange=settings.usuarios_shard_exchange,
+            queue=queue_name,
+            routing_key="1"
+        )
+
+        logger.info("✅ Partición configurada: %s", queue_name)
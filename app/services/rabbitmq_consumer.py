@@ -1,8 +1,10 @@
 import pika
-import json
+import msgspec
 import logging
-import time
 
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timezone
+from functools import partial
 from typing import Callable
 from app.config.settings import settings
 from app.models.events import (
@@ -14,230 +16,370 @@ from app.models.events import (
 
 logger = logging.getLogger(__name__)
 
-class RabbitMQConsumer:
-    """
-    Consumidor de mensajes de RabbitMQ.
-    Escucha múltiples colas y procesa eventos de dominio.
-    """
-
-    def __init__(self):
-        self.connection = None
-        self.channel = None
-        self.setup_connection()
+# Referencias directas a los métodos del logger usados en el bucle de mensajes
+_DBG = logger.debug
+_ERR = logger.error
 
-    def setup_connection(self):
+# Bytes del cuerpo del mensaje que se muestran en los logs de depuración
+DEBUG_BODY_LIMIT = 200
 
-        MAX_RETRIES = 20
-        WAIT_SECONDS = 3
+# Prefetch usado si la configuración pide 0 (ilimitado) o un valor inválido
+DEFAULT_PREFETCH = 100
 
-        credentials = pika.PlainCredentials(
-            settings.rabbitmq_user,
-            settings.rabbitmq_password
-        )
+# Timestamps numéricos por encima de este valor son milisegundos (como en pydantic)
+_MS_TIMESTAMP_THRESHOLD = 2e10
 
-        parameters = pika.ConnectionParameters(
-            host=settings.rabbitmq_host,
-            port=settings.rabbitmq_port,
-            credentials=credentials,
-            heartbeat=600,
-            blocked_connection_timeout=300
-        )
-
-        attempt = 1
-        while attempt <= MAX_RETRIES:
+def _lax_datetime(value):
+    """
+    Convierte los formatos de fecha que msgspec rechaza pero los productores
+    envían (y pydantic aceptaba): epoch en milisegundos, epoch como texto,
+    ISO sin segundos ("2024-01-01T10:00") o solo fecha ("2024-01-01").
+    Si no se reconoce, devuelve el valor tal cual y la validación falla.
+    """
+    if isinstance(value, str):
+        try:
+            return datetime.fromisoformat(value)
+        except ValueError:
             try:
-                logger.info(f"🔄 Intentando conectar a RabbitMQ (intento {attempt}/{MAX_RETRIES})...")
-                self.connection = pika.BlockingConnection(parameters)
-                self.channel = self.connection.channel()
+                value = float(value)
+            except ValueError:
+                return value
 
-                # Declarar exchange y colas
-                self.channel.exchange_declare(
-                    exchange=settings.exchange_name,
-                    exchange_type='topic',
-                    durable=True
-                )
-                self._declare_queues()
-
-                logger.info("✅ Conexión a RabbitMQ establecida exitosamente")
-                return
-
-            except Exception as e:
-                logger.error(f"❌ Error conectando a RabbitMQ: {e}")
-                if attempt == MAX_RETRIES:
-                    logger.critical("🔥 No se pudo conectar después de múltiples intentos. Abortando.")
-                    raise
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        if abs(value) > _MS_TIMESTAMP_THRESHOLD:
+            value = value / 1000
+        try:
+            return datetime.fromtimestamp(value, tz=timezone.utc)
+        except (OverflowError, OSError, ValueError):
+            pass
+    return value
 
-                wait = WAIT_SECONDS
-                logger.info(f"⏳ Reintentando en {wait} segundos...")
-                time.sleep(wait)
-                attempt += 1
+def _decoder(model_cls):
+    """
+    Función de decodificación para un tipo de evento.
+    El camino rápido es el Decoder precompilado de msgspec (strict=False
+    acepta además epoch en segundos). Si la validación falla, se reintenta
+    normalizando los campos datetime con _lax_datetime, para no rechazar
+    los formatos de fecha que el modelo pydantic anterior aceptaba.
+    """
+    decode = msgspec.json.Decoder(model_cls, strict=False).decode
+    datetime_fields = tuple(
+        field.encode_name for field in msgspec.structs.fields(model_cls) if field.type is datetime
+    )
 
+    def decode_event(body: bytes):
+        try:
+            return decode(body)
+        except msgspec.ValidationError:
+            data = msgspec.json.decode(body)
+            if not isinstance(data, dict) or not datetime_fields:
+                raise
+            for name in datetime_fields:
+                if name in data:
+                    data[name] = _lax_datetime(data[name])
+            return msgspec.convert(data, model_cls, strict=False)
+
+    return decode_event
+
+# Cola -> función que decodifica el tipo de evento que llega por ella
+EVENT_MAP = {
+    settings.usuarios_consume_queue: _decoder(UsuarioCreadoEvent),
+    settings.sesiones_queue: _decoder(SesionIniciadaEvent),
+    settings.password_reset_queue: _decoder(PasswordResetSolicitadoEvent),
+    settings.password_updated_queue: _decoder(PasswordActualizadoEvent),
+}
+
+class _AckBatcher:
+    """
+    Agrupa los acks de un canal en un único basic_ack(multiple=True).
+    Confirma al acumular batch_size mensajes o tras flush_interval segundos,
+    para que con poco tráfico los acks no se retrasen.
+
+    Los workers terminan los mensajes fuera de orden, así que solo se confirma
+    hasta el mayor delivery tag cuyos anteriores ya terminaron: el ack
+    múltiple nunca cubre un mensaje aún en proceso. Los nacks se envían al
+    momento. Solo se usa desde el thread dueño de la conexión.
+    """
 
-    def _declare_queues(self):
+    def __init__(self, connection, channel, batch_size: int, flush_interval: float):
+        self.connection = connection
+        self.channel = channel
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._next_tag = 1  # Menor delivery tag aún sin terminar
+        self._done = {}  # Tags terminados fuera de orden -> True (ack) / False (nack)
+        self._pending = 0
+        self._last_tag = None
+        self._timer = None
+
+    def ack(self, delivery_tag: int):
+        """Registra un mensaje procesado; confirma el lote si está completo"""
+        self._complete(delivery_tag, True)
+
+    def nack(self, delivery_tag: int, requeue: bool = False):
         """
-        Declara todas las colas necesarias y las vincula al exchange.
-        Cada cola se asocia con su routing key específico.
+        Rechaza un mensaje. Por defecto sin reencolar (evita loops infinitos
+        con mensajes inválidos); los fallos transitorios piden requeue.
         """
-        queues_config = [
-            (settings.usuarios_queue, "usuarios.created"),
-            (settings.sesiones_queue, "sesiones.iniciada"),
-            (settings.password_reset_queue, "password.reset.requested"),
-            (settings.password_updated_queue, "password.updated"),
-        ]
-
-        for queue_name, routing_key in queues_config:
-            # Declarar cola como durable para persistencia
-            self.channel.queue_declare(queue=queue_name, durable=True)
+        if self.channel.is_open:
+            self.channel.basic_nack(delivery_tag=delivery_tag, requeue=requeue)
+        self._complete(delivery_tag, False)
+
+    def _complete(self, delivery_tag: int, acked: bool):
+        self._done[delivery_tag] = acked
+
+        # Avanzar sobre el prefijo contiguo de mensajes terminados
+        while self._next_tag in self._done:
+            if self._done.pop(self._next_tag):
+                self._last_tag = self._next_tag
+                self._pending += 1
+            self._next_tag += 1
+
+        if self._pending >= self.batch_size:
+            self.flush()
+        elif self._pending and self._timer is None:
+            self._timer = self.connection.call_later(self.flush_interval, self._on_timer)
+
+    def flush(self):
+        """Confirma en una sola trama todos los mensajes hasta el último registrado"""
+        if self._timer is not None:
+            self.connection.remove_timeout(self._timer)
+            self._timer = None
+        if self._last_tag is None:
+            return
+
+        if self.channel.is_open:
+            self.channel.basic_ack(delivery_tag=self._last_tag, multiple=True)
+        self._last_tag = None
+        self._pending = 0
+
+    def _on_timer(self):
+        self._timer = None
+        self.flush()
 
-            # Vincular cola al exchange con routing key
-            self.channel.queue_bind(
-                exchange=settings.exchange_name,
-                queue=queue_name,
-                routing_key=routing_key
-            )
 
-            logger.info(f"✅ Cola configurada: {queue_name} -> {routing_key}")
+class RabbitMQConsumer:
+    """
+    Consumidor de mensajes de RabbitMQ.
+    Escucha múltiples colas y procesa eventos de dominio. Cada cola tiene su
+    propio canal (con su QoS y sus acks), así que una cola lenta no retrasa
+    las entregas ni los acks de las demás.
+
+    La conexión del consumidor es exclusiva para consumir: nunca debe usarse
+    para publicar. Si el broker aplica control de flujo (connection.blocked)
+    a una conexión que publica, la bloquea entera y el consumo dejaría de
+    drenar las colas. Las publicaciones van por una conexión aparte
+    (ver NotificationPublisher).
+    """
 
-    def consume_usuarios(self, callback: Callable):
+    def __init__(self, connection: pika.BlockingConnection):
         """
-        Consume eventos de usuarios creados.
-
         Args:
-            callback: Función a ejecutar cuando se reciba un mensaje
+            connection: Conexión dedicada al consumo
         """
-        def on_message(ch, method, properties, body):
-            try:
-                # Deserializar mensaje JSON
-                data = json.loads(body.decode('utf-8'))
-                logger.debug(f"📩 Mensaje recibido en usuarios.events: {data}")
+        self.connection = connection
 
-                # Parsear a objeto Pydantic para validación
-                event = UsuarioCreadoEvent(**data)
+        # Cola -> canal de consumo y sus acks agrupados (se abren en _consume)
+        self.channels = {}
+        self._acks = {}
 
-                # Ejecutar callback
-                callback(event)
+        # prefetch 0 significa "sin límite" en AMQP: se sustituye por el valor por defecto.
+        self.prefetch_count = settings.prefetch_count if settings.prefetch_count > 0 else DEFAULT_PREFETCH
 
-                # Confirmar procesamiento exitoso
-                ch.basic_ack(delivery_tag=method.delivery_tag)
-                logger.debug(f"✅ Mensaje procesado y confirmado")
+        # Los callbacks corren en un pool de workers: un mensaje lento no
+        # frena los heartbeats ni las entregas del thread de I/O
+        self.workers = max(1, min(settings.consumer_workers, self.prefetch_count))
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="consumer-worker")
+        self._running = True
 
-            except Exception as e:
-                logger.error(f"❌ Error procesando evento de usuario: {e}")
-                # Rechazar mensaje sin reencolar (evita loops infinitos)
-                ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
+        logger.info("✅ Consumidor configurado (prefetch=%s por cola, workers=%s)", self.prefetch_count, self.workers)
 
-        # Configurar consumidor
-        self.channel.basic_consume(
-            queue=settings.usuarios_queue,
-            on_message_callback=on_message
-        )
-        logger.info(f"👂 Escuchando en cola: {settings.usuarios_queue}")
-
-    def consume_sesiones(self, callback: Callable):
+    def _open_channel(self, queue: str) -> pika.adapters.blocking_connection.BlockingChannel:
         """
-        Consume eventos de sesiones iniciadas.
+        Abre el canal de consumo de una cola con su QoS y su agrupador de acks.
 
         Args:
-            callback: Función a ejecutar cuando se reciba un mensaje
-        """
-        def on_message(ch, method, properties, body):
-            try:
-                data = json.loads(body.decode('utf-8'))
-                logger.debug(f"📩 Mensaje recibido en sesiones.events: {data}")
-
-                event = SesionIniciadaEvent(**data)
-                callback(event)
-
-                ch.basic_ack(delivery_tag=method.delivery_tag)
-                logger.debug(f"✅ Mensaje procesado y confirmado")
-
-            except Exception as e:
-                logger.error(f"❌ Error procesando evento de sesión: {e}")
-                ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
+            queue: Nombre de la cola que se consumirá en el canal
 
-        self.channel.basic_consume(
-            queue=settings.sesiones_queue,
-            on_message_callback=on_message
+        Returns:
+            Canal abierto sobre la conexión del consumidor
+        """
+        channel = self.connection.channel()
+
+        # Limitar los mensajes en vuelo por cola (control de flujo del broker)
+        channel.basic_qos(prefetch_count=self.prefetch_count, global_qos=False)
+
+        # Acks por lotes; el lote nunca supera el prefetch o el broker dejaría
+        # de entregar mensajes hasta que venciera el temporizador
+        self._acks[queue] = _AckBatcher(
+            self.connection,
+            channel,
+            batch_size=max(1, min(settings.ack_batch_size, self.prefetch_count)),
+            flush_interval=settings.ack_flush_interval
         )
-        logger.info(f"👂 Escuchando en cola: {settings.sesiones_queue}")
+        self.channels[queue] = channel
 
-    def consume_password_reset(self, callback: Callable):
+        logger.info("✅ Canal de consumo abierto para %s", queue)
+        return channel
+
+    def _consume(self, queue: str, callback: Callable):
         """
-        Consume eventos de reset de password solicitados.
+        Registra un consumidor genérico sobre una cola.
+        Cada mensaje se procesa en el pool de workers: se decodifica al tipo
+        de evento de la cola (EVENT_MAP) y se ejecuta el callback. El ack (o
+        el nack sin reencolar si el mensaje no se puede decodificar o el
+        callback falla) se agenda de vuelta en el thread de la conexión,
+        único que puede usar el canal.
 
         Args:
-            callback: Función a ejecutar cuando se reciba un mensaje
+            queue: Nombre de la cola a consumir (clave de EVENT_MAP)
+            callback: Función a ejecutar con el evento decodificado. Si
+                devuelve un Future (publicación pendiente), el ack espera a
+                que se complete; si este falla, el mensaje se reencola.
         """
-        def on_message(ch, method, properties, body):
+        decode = EVENT_MAP[queue]
+        channel = self._open_channel(queue)
+        ack = self._acks[queue].ack
+        nack = self._acks[queue].nack
+        add_callback = self.connection.add_callback_threadsafe
+        submit = self._executor.submit
+
+        def process(delivery_tag, body):
+            debug_enabled = logger.isEnabledFor(logging.DEBUG)
+            if debug_enabled:
+                # Solo el inicio del cuerpo: no se copia el payload completo
+                _DBG("📩 Mensaje recibido en %s: %s", queue,
+                     body[:DEBUG_BODY_LIMIT].decode('utf-8', errors='replace'))
             try:
-                data = json.loads(body.decode('utf-8'))
-                logger.debug(f"📩 Mensaje recibido en password.reset.requested: {data}")
+                # Deserializar y validar el mensaje JSON directamente desde bytes
+                event = decode(body)
 
-                event = PasswordResetSolicitadoEvent(**data)
-                callback(event)
+                # Ejecutar callback
+                result = callback(event)
 
-                ch.basic_ack(delivery_tag=method.delivery_tag)
-                logger.debug(f"✅ Mensaje procesado y confirmado")
+                if isinstance(result, Future):
+                    # El ack espera a que la notificación quede publicada
+                    result.add_done_callback(partial(on_published, delivery_tag))
+                    return
 
-            except Exception as e:
-                logger.error(f"❌ Error procesando evento de password reset: {e}")
-                ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
+                # Confirmar procesamiento exitoso (ack agrupado)
+                settle = ack
+                if debug_enabled:
+                    _DBG("✅ Mensaje procesado")
 
-        self.channel.basic_consume(
-            queue=settings.password_reset_queue,
-            on_message_callback=on_message
-        )
-        logger.info(f"👂 Escuchando en cola: {settings.password_reset_queue}")
+            except Exception as e:
+                _ERR("❌ Error procesando mensaje de %s: %s", queue, e)
+                settle = nack
 
-    def consume_password_updated(self, callback: Callable):
-        """
-        Consume eventos de password actualizado.
+            try:
+                add_callback(partial(settle, delivery_tag))
+            except Exception as e:
+                # Conexión cerrada: el broker reentregará el mensaje
+                _ERR("❌ No se pudo confirmar el mensaje de %s: %s", queue, e)
+
+        def on_published(delivery_tag, future):
+            # Corre en el thread que completa el Future (el del publicador)
+            if future.exception() is None:
+                settle = ack
+            else:
+                _ERR("❌ Notificación de %s sin publicar, se reencola: %s", queue, future.exception())
+                settle = partial(nack, requeue=True)
+            try:
+                add_callback(partial(settle, delivery_tag))
+            except Exception as e:
+                # Conexión cerrada: el broker reentregará el mensaje
+                _ERR("❌ No se pudo confirmar el mensaje de %s: %s", queue, e)
 
-        Args:
-            callback: Función a ejecutar cuando se reciba un mensaje
-        """
         def on_message(ch, method, properties, body):
-            try:
-                data = json.loads(body.decode('utf-8'))
-                logger.debug(f"📩 Mensaje recibido en password.updated: {data}")
+            submit(process, method.delivery_tag, body)
 
-                event = PasswordActualizadoEvent(**data)
-                callback(event)
+        # Configurar consumidor
+        channel.basic_consume(queue=queue, on_message_callback=on_message)
+        logger.info("👂 Escuchando en cola: %s", queue)
 
-                ch.basic_ack(delivery_tag=method.delivery_tag)
-                logger.debug(f"✅ Mensaje procesado y confirmado")
+    def consume_usuarios(self, callback: Callable):
+        """Consume eventos de usuarios creados."""
+        self._consume(settings.usuarios_consume_queue, callback)
 
-            except Exception as e:
-                logger.error(f"❌ Error procesando evento de password updated: {e}")
-                ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
+    def consume_sesiones(self, callback: Callable):
+        """Consume eventos de sesiones iniciadas."""
+        self._consume(settings.sesiones_queue, callback)
 
-        self.channel.basic_consume(
-            queue=settings.password_updated_queue,
-            on_message_callback=on_message
-        )
-        logger.info(f"👂 Escuchando en cola: {settings.password_updated_queue}")
+    def consume_password_reset(self, callback: Callable):
+        """Consume eventos de reset de password solicitados."""
+        self._consume(settings.password_reset_queue, callback)
+
+    def consume_password_updated(self, callback: Callable):
+        """Consume eventos de password actualizado."""
+        self._consume(settings.password_updated_queue, callback)
 
     def start_consuming(self):
         """
         Inicia el consumo de mensajes.
-        Este método es bloqueante y mantendrá el proceso corriendo.
+        Este método es bloqueante: atiende la conexión (entregas, heartbeats,
+        acks agendados por los workers) hasta que se llame a stop().
+        No cierra nada al salir: el cierre ordenado (drain, publicador,
+        close) lo hace quien lo llama.
         """
         logger.info("🚀 Iniciando consumo de mensajes...")
         try:
-            self.channel.start_consuming()
+            while self._running:
+                self.connection.process_data_events(time_limit=1)
         except KeyboardInterrupt:
             logger.info("⚠️ Consumo interrumpido por el usuario")
-            self.close()
         except Exception as e:
-            logger.error(f"❌ Error durante el consumo: {e}")
-            self.close()
+            logger.error("❌ Error durante el consumo: %s", e)
             raise
 
-    def close(self):
-        """Cierra la conexión a RabbitMQ de forma segura"""
+    def stop(self):
+        """
+        Solicita detener el consumo de forma segura desde cualquier thread.
+        El bucle de start_consuming() termina en como mucho un segundo.
+        """
+        self._running = False
+
+    def drain(self):
+        """
+        Deja de recibir mensajes y espera a que los workers terminen los que
+        están en curso, ejecutando después sus acks agendados.
+        Debe llamarse desde el thread de la conexión.
+        """
+        if self._executor is None:
+            return
+
         try:
-            if self.connection and not self.connection.is_closed:
-                self.connection.close()
-                logger.info("👋 Conexión a RabbitMQ cerrada")
+            for channel in self.channels.values():
+                if channel.is_open:
+                    for consumer_tag in list(channel.consumer_tags):
+                        channel.basic_cancel(consumer_tag)
         except Exception as e:
-            logger.error(f"❌ Error cerrando conexión: {e}")
\ No newline at end of file
+            logger.error("❌ Error cancelando consumidores: %s", e)
+
+        self._executor.shutdown(wait=True)
+        self._executor = None
+        self._run_pending_callbacks()
+
+    def _run_pending_callbacks(self):
+        """Ejecuta los acks y nacks agendados desde otros threads"""
+        try:
+            if self.connection and self.connection.is_open:
+                self.connection.process_data_events(time_limit=0)
+        except Exception as e:
+            logger.error("❌ Error procesando acks pendientes: %s", e)
+
+    def close(self):
+        """
+        Termina los mensajes en curso, confirma los acks pendientes y cierra
+        los canales. Si hay un publicador, debe cerrarse antes para que sus
+        últimos lotes liberen los acks que esperan.
+        """
+        self.drain()
+        self._run_pending_callbacks()
+        for queue, channel in self.channels.items():
+            try:
+                if channel.is_open:
+                    self._acks[queue].flush()
+                    channel.close()
+                    logger.info("👋 Canal de consumo de %s cerrado", queue)
+            except Exception as e:
+                logger.error("❌ Error cerrando canal de consumo de %s: %s", queue, e)
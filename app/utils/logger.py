@@ -1,9 +1,66 @@
+import atexit
+import copy
 import logging
+import msgspec
+import queue
 import sys
-from pythonjsonlogger import jsonlogger
+from logging.handlers import QueueHandler, QueueListener
+
+# Listener que formatea y escribe los logs en su propio thread
+_listener = None
+
+_ENCODER = msgspec.json.Encoder()
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formatea cada registro como una línea JSON con las claves asctime, name,
+    levelname y message (más exc_info si hay excepción). Serializa con
+    msgspec, igual que los eventos, en lugar del módulo json de la stdlib.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        log_record = {
+            'asctime': self.formatTime(record, self.datefmt),
+            'name': record.name,
+            'levelname': record.levelname,
+            'message': record.getMessage(),
+        }
+        if record.exc_info:
+            log_record['exc_info'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            log_record['exc_info'] = record.exc_text
+        return _ENCODER.encode(log_record).decode()
+
+
+class _QueueHandler(QueueHandler):
+    """
+    Encola el registro con el mensaje ya resuelto y el traceback como texto;
+    el JSON se genera en el listener.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
 
 def setup_logging():
-    """Configura el logging con formato JSON"""
+    """
+    Configura el logging con formato JSON.
+    Los threads que loguean solo encolan el registro; el formateo JSON y la
+    escritura a stdout ocurren en el thread del QueueListener.
+    """
+    global _listener
+
+    # Idempotente: el módulo principal puede importarse dos veces (uvicorn)
+    if _listener is not None:
+        return
+
     logger = logging.getLogger()
     logger.setLevel(logging.INFO)
 
@@ -11,9 +68,13 @@ def setup_logging():
     handler = logging.StreamHandler(sys.stdout)
 
     # Formato JSON
-    formatter = jsonlogger.JsonFormatter(
-        '%(asctime)s %(name)s %(levelname)s %(message)s'
-    )
-    handler.setFormatter(formatter)
+    handler.setFormatter(JsonFormatter())
+
+    log_queue = queue.Queue(-1)
+    logger.addHandler(_QueueHandler(log_queue))
+
+    _listener = QueueListener(log_queue, handler, respect_handler_level=True)
+    _listener.start()
 
-    logger.addHandler(handler)
\ No newline at end of file
+    # Al salir se vacía la cola antes de terminar el proceso
+    atexit.register(_listener.stop)